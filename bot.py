@@ -1,9 +1,29 @@
+import asyncio
+import cProfile
+import io
 import logging
 import os
 import re
 import json
+import math
+import pstats
+import random
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+import tracemalloc
+import uuid
+import zlib
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
 from urllib.parse import urlparse, parse_qs, urlunparse
+from datetime import timedelta
 from telegram import Update, InputMediaPhoto, InputMediaVideo
+from telegram.error import Forbidden, NetworkError, RetryAfter
 from telegram.ext import (
     Application,
     MessageHandler,
@@ -12,6 +32,7 @@ from telegram.ext import (
     CommandHandler,
 )
 from dotenv import load_dotenv, set_key
+import httpx
 
 # Enable logging
 logging.basicConfig(
@@ -28,6 +49,25 @@ if not TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN environment variable is not set")
 
 
+# Self-hosted telegram-bot-api server, e.g. http://localhost:8081/bot
+# In local mode the server reads uploads straight from disk by path, so it
+# has to see ./tmp under the same absolute path as the bot
+BOT_API_URL = os.getenv("BOT_API_URL")
+BOT_API_FILE_URL = os.getenv("BOT_API_FILE_URL")
+BOT_API_LOCAL_MODE = (
+    bool(BOT_API_URL) and os.getenv("BOT_API_LOCAL_MODE", "false").lower() == "true"
+)
+
+# Bot API upload limits: 50 MB on the public server, 2000 MB on a local one
+UPLOAD_LIMIT = int(
+    os.getenv(
+        "UPLOAD_LIMIT",
+        str((2000 if BOT_API_LOCAL_MODE else 50) * 1024 * 1024),
+    )
+)
+UPLOAD_TIMEOUT = float(os.getenv("UPLOAD_TIMEOUT", "600" if BOT_API_LOCAL_MODE else "20"))
+
+
 # Load accepted users from .env
 def load_accepted_users():
     """Load accepted users from .env file"""
@@ -121,77 +161,1049 @@ def extract_urls(text):
     return re.findall(url_pattern, text)
 
 
-def download_media(url):
-    """Download media using gallery-dl"""
-    import subprocess
+# Quality profiles, mapped to gallery-dl options as (config path, value) pairs.
+# Twitter images are capped through the `size` fallback list, videos are
+# routed through yt-dlp so a height limit can be applied to the format.
+# Instagram videos are DASH manifests downloaded by yt-dlp, so the format
+# applies to them too, merging separate video and audio streams. Instagram
+# images have no size option and are always downloaded at full size.
+QUALITY_PROFILES = {
+    "original": [],
+    "balanced": [
+        ("extractor.twitter.size", ["large", "medium", "small"]),
+        ("extractor.twitter.videos", "ytdl"),
+        ("extractor.ytdl.format", "b[height<=720]/bv*[height<=720]+ba/b/bv*+ba"),
+        ("downloader.ytdl.format", "b[height<=720]/bv*[height<=720]+ba/b/bv*+ba"),
+    ],
+    "data_saver": [
+        ("extractor.twitter.size", ["medium", "small"]),
+        ("extractor.twitter.videos", "ytdl"),
+        ("extractor.ytdl.format", "b[height<=480]/bv*[height<=480]+ba/w/wv*+ba"),
+        ("downloader.ytdl.format", "b[height<=480]/bv*[height<=480]+ba/w/wv*+ba"),
+    ],
+}
+
+DEFAULT_QUALITY = os.getenv("DEFAULT_QUALITY", "original")
+if DEFAULT_QUALITY not in QUALITY_PROFILES:
+    logger.warning(f"Unknown DEFAULT_QUALITY '{DEFAULT_QUALITY}', using 'original'")
+    DEFAULT_QUALITY = "original"
+
+# Downloaded jobs and bytes per quality profile, reported by /quality. Bytes
+# saved are measured per job against the extraction pass estimate of the
+# original variants, for jobs that had one.
+QUALITY_STATS = {
+    name: {"jobs": 0, "bytes": 0, "saved": 0, "measured": 0}
+    for name in QUALITY_PROFILES
+}
+
+
+def load_quality_prefs():
+    """Load per-chat/per-user quality profiles from .env file"""
+    prefs = {}
+    for entry in os.getenv("QUALITY_PREFS", "").split(","):
+        target_id, _, profile = entry.strip().partition(":")
+        if target_id and profile in QUALITY_PROFILES:
+            prefs[target_id] = profile
+    return prefs
+
+
+QUALITY_PREFS = load_quality_prefs()
+
+
+def set_quality_pref(target_id, profile):
+    """Store the quality profile for a chat or user"""
+    global QUALITY_PREFS
+
+    prefs = load_quality_prefs()
+    prefs[str(target_id)] = profile
+
+    # Update .env file
+    set_key(
+        ".env",
+        "QUALITY_PREFS",
+        ",".join(f"{key}:{value}" for key, value in prefs.items()),
+    )
 
-    # Create a temporary directory for downloads
-    # dont use tempfile, use `./tmp` folder instead
-    tmpdir = "./tmp"
-    os.makedirs(tmpdir, exist_ok=True)
+    # Reload environment variables and update global prefs
+    load_dotenv(override=True)
+    QUALITY_PREFS = load_quality_prefs()
+
+
+def get_quality(chat_id, user_id):
+    """Get the quality profile for a chat, falling back to the user's and the default"""
+    return (
+        QUALITY_PREFS.get(str(chat_id))
+        or QUALITY_PREFS.get(str(user_id))
+        or DEFAULT_QUALITY
+    )
+
+
+def quality_options(profile):
+    """Build gallery-dl command line options for a quality profile"""
+    options = []
+    for key, value in QUALITY_PROFILES.get(profile, []):
+        options += ["-o", f"{key}={json.dumps(value)}"]
+    return options
+
+
+def format_bytes(size):
+    """Format a byte count for humans"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} {unit}"
+        size /= 1024
+
+
+def record_quality_stats(profile, file_paths, original_bytes=None):
+    """Add a finished download to the per-profile byte counters
+
+    `original_bytes` is the estimated size of the job at original quality.
+    """
+    total = 0
+    for file_path in file_paths:
+        try:
+            total += os.path.getsize(file_path)
+        except OSError:
+            pass
+
+    stats = QUALITY_STATS.setdefault(
+        profile, {"jobs": 0, "bytes": 0, "saved": 0, "measured": 0}
+    )
+    stats["jobs"] += 1
+    stats["bytes"] += total
+    if original_bytes is not None and profile != "original":
+        stats["saved"] += max(0, original_bytes - total)
+        stats["measured"] += 1
+    logger.info(
+        f"Downloaded {len(file_paths)} file(s), {format_bytes(total)} with '{profile}' quality"
+    )
+
+
+# Temporary download directory, every job downloads into its own `job-*` folder
+TMP_DIR = "./tmp"
+JOB_DIR_PREFIX = "job-"
+# Job folders older than this (seconds) are considered orphaned
+TMP_MAX_AGE = int(os.getenv("TMP_MAX_AGE", "3600"))
+JANITOR_INTERVAL = int(os.getenv("JANITOR_INTERVAL", "600"))
+
+# Disk admission control: every job reserves a budget, and jobs are deferred
+# while free space minus reserved budgets would drop below the watermark
+JOB_DISK_BUDGET = int(os.getenv("JOB_DISK_BUDGET", str(500 * 1024 * 1024)))
+DISK_FREE_WATERMARK = int(os.getenv("DISK_FREE_WATERMARK", str(1024 * 1024 * 1024)))
+ADMISSION_TIMEOUT = int(os.getenv("ADMISSION_TIMEOUT", "600"))
+# Messages handled at the same time, downloads themselves are bounded by the job lanes
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "32"))
+
+ACTIVE_JOB_DIRS = set()
+disk_reserved = 0
+disk_condition = None
+janitor_task = None
+
+
+def new_job_dir():
+    """Create a fresh download folder for a job"""
+    job_dir = os.path.join(TMP_DIR, f"{JOB_DIR_PREFIX}{uuid.uuid4().hex}")
+    os.makedirs(job_dir, exist_ok=True)
+    ACTIVE_JOB_DIRS.add(job_dir)
+    return job_dir
+
+
+def remove_job_dir(job_dir):
+    """Delete a job folder with everything left in it"""
+    ACTIVE_JOB_DIRS.discard(job_dir)
+    shutil.rmtree(job_dir, ignore_errors=True)
+
+
+def sweep_tmp(max_age):
+    """Delete orphaned job folders and leftover downloads older than max_age seconds"""
+    if not os.path.isdir(TMP_DIR):
+        return
+
+    now = time.time()
+    removed = 0
+    for entry in os.scandir(TMP_DIR):
+        if entry.path in ACTIVE_JOB_DIRS:
+            continue
+        try:
+            if now - entry.stat().st_mtime < max_age:
+                continue
+            if entry.is_dir() and entry.name.startswith(JOB_DIR_PREFIX):
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+            # Leftovers from before job folders existed, cookies are kept
+            elif entry.is_file() and (
+                entry.name == "info.json"
+                or entry.name.endswith((".part", ".jpg", ".jpeg", ".png", ".gif", ".webp"))
+                or entry.name.endswith(VIDEO_EXTENSIONS)
+            ):
+                os.remove(entry.path)
+                removed += 1
+        except OSError as e:
+            logger.error(f"Error sweeping {entry.path}: {e}")
+
+    if removed:
+        logger.info(f"Janitor removed {removed} orphaned item(s) from {TMP_DIR}")
+
+
+async def janitor_loop():
+    """Periodically sweep orphaned job folders"""
+    while True:
+        await asyncio.sleep(JANITOR_INTERVAL)
+        await asyncio.to_thread(sweep_tmp, TMP_MAX_AGE)
+
+
+def has_disk_room(budget):
+    """Check if a job with this budget fits above the free space watermark"""
+    os.makedirs(TMP_DIR, exist_ok=True)
+    free = shutil.disk_usage(TMP_DIR).free
+    return free - disk_reserved - budget >= DISK_FREE_WATERMARK
+
+
+def get_disk_condition():
+    """Condition notified whenever a job releases its disk budget"""
+    global disk_condition
+    if disk_condition is None:
+        disk_condition = asyncio.Condition()
+    return disk_condition
+
+
+async def wait_for_disk_room(budget):
+    """Wait until a budget fits, with disk_condition held
+
+    Returns False if no room became available within ADMISSION_TIMEOUT.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + ADMISSION_TIMEOUT
+    while not has_disk_room(budget):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return False
+        logger.info("Low disk space, deferring job")
+        # Wake up when another job finishes, or re-check free space periodically
+        try:
+            await asyncio.wait_for(disk_condition.wait(), timeout=min(30, remaining))
+        except asyncio.TimeoutError:
+            pass
+    return True
+
+
+async def disk_room_available(budget=JOB_DISK_BUDGET):
+    """Wait for disk room without reserving it, e.g. before taking a lane slot"""
+    async with get_disk_condition():
+        return await wait_for_disk_room(budget)
+
+
+@asynccontextmanager
+async def disk_admission(budget=JOB_DISK_BUDGET):
+    """Reserve disk budget for a job, waiting while the disk is under the watermark
+
+    Yields False if no room became available within ADMISSION_TIMEOUT.
+    """
+    global disk_reserved
+
+    async with get_disk_condition():
+        admitted = await wait_for_disk_room(budget)
+        if admitted:
+            disk_reserved += budget
+
+    if not admitted:
+        logger.warning("Not enough disk space, job rejected")
+        yield False
+        return
 
-    # Change this to download the media and metadata together instead do it seperately
-    # Use gallery-dl --write-info-json --directory . [url]
-    # Run gallery-dl to download media and metadata together
-    download_cmd = [
+    try:
+        yield True
+    finally:
+        async with disk_condition:
+            disk_reserved -= budget
+            disk_condition.notify_all()
+
+
+# gallery-dl error classes, checked in order against its exit code and stderr.
+# Exit code bits: 4 HTTP error, 8 not found, 16 auth error, 64 unsupported URL
+DOWNLOAD_ERROR_CLASSES = [
+    ("unsupported", 64, re.compile(r"unsupported url|no suitable extractor", re.I)),
+    ("rate_limited", 0, re.compile(r"\b429\b|too many requests|rate.?limit", re.I)),
+    (
+        "auth_expired",
+        16,
+        re.compile(
+            r"\b40[13]\b|login required|authenticationerror|authorizationerror|"
+            r"redirect to login|checkpoint required",
+            re.I,
+        ),
+    ),
+    ("not_found", 8, re.compile(r"\b40[04]\b|\b410\b|notfounderror|not found", re.I)),
+    (
+        "transient",
+        4,
+        re.compile(
+            r"timed? ?out|connection|\b5\d\d\b|temporar|remote end closed|"
+            r"reset by peer|incomplete|chunkedencodingerror",
+            re.I,
+        ),
+    ),
+]
+RETRIABLE_ERRORS = {"transient", "rate_limited"}
+
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "2"))
+RATE_LIMIT_BASE_DELAY = float(os.getenv("RATE_LIMIT_BASE_DELAY", "30"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "120"))
+
+
+def classify_download_error(returncode, stderr):
+    """Classify a failed gallery-dl run from its exit code and stderr"""
+    for kind, code_bit, pattern in DOWNLOAD_ERROR_CLASSES:
+        if pattern.search(stderr or ""):
+            return kind
+    for kind, code_bit, pattern in DOWNLOAD_ERROR_CLASSES:
+        if code_bit and returncode > 0 and returncode & code_bit:
+            return kind
+    return "unknown"
+
+
+def retry_delay(kind, attempt):
+    """Exponential backoff with full jitter, longer for rate limits"""
+    base = RATE_LIMIT_BASE_DELAY if kind == "rate_limited" else RETRY_BASE_DELAY
+    return random.uniform(0, min(RETRY_MAX_DELAY, base * 2**attempt))
+
+
+def run_gallery_dl(download_cmd):
+    """Run gallery-dl, retrying retriable errors
+
+    Retries reuse the same job folder: finished files are skipped and
+    `.part` files are resumed with a Range request by gallery-dl itself.
+    Returns the last CompletedProcess and its error class (None on success).
+    """
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        result = subprocess.run(download_cmd, capture_output=True, text=True)
+        if result.returncode == 0:
+            return result, None
+
+        kind = classify_download_error(result.returncode, result.stderr)
+        if kind not in RETRIABLE_ERRORS or attempt == DOWNLOAD_RETRIES:
+            logger.error(f"gallery-dl download failed ({kind}): {result.stderr}")
+            if kind == "auth_expired":
+                logger.error("Session cookies may have expired, run the login scripts again")
+            return result, kind
+
+        delay = retry_delay(kind, attempt)
+        logger.warning(
+            f"gallery-dl download failed ({kind}), retry {attempt + 1}/{DOWNLOAD_RETRIES} in {delay:.1f}s"
+        )
+        time.sleep(delay)
+
+
+# Size-aware scheduling: a quick extraction pass estimates the bytes of a job,
+# small jobs run on the fast lane and big jobs on a separate bounded lane.
+# Big jobs waiting longer than JOB_AGING_SECONDS may also take a fast lane slot.
+SIZE_AWARE_SCHEDULING = os.getenv("SIZE_AWARE_SCHEDULING", "true").lower() == "true"
+SMALL_JOB_BYTES = int(os.getenv("SMALL_JOB_BYTES", str(20 * 1024 * 1024)))
+FAST_LANE_WORKERS = int(os.getenv("FAST_LANE_WORKERS", "3"))
+BIG_LANE_WORKERS = int(os.getenv("BIG_LANE_WORKERS", "1"))
+JOB_AGING_SECONDS = float(os.getenv("JOB_AGING_SECONDS", "60"))
+EXTRACTION_TIMEOUT = int(os.getenv("EXTRACTION_TIMEOUT", "60"))
+# Authenticated extraction passes running at once, they run before the lanes
+EXTRACTION_CONCURRENCY = int(os.getenv("EXTRACTION_CONCURRENCY", "4"))
+
+# Fallback estimates when gallery-dl declares no file size
+PHOTO_BYTES_ESTIMATE = 1024 * 1024
+VIDEO_BYTES_ESTIMATE = 25 * 1024 * 1024
+VIDEO_BYTES_PER_SECOND = 300 * 1024
+# Rough share of the original size downloaded per quality profile
+QUALITY_SIZE_FACTORS = {"original": 1.0, "balanced": 0.5, "data_saver": 0.25}
+
+FAST_LANE = asyncio.Semaphore(FAST_LANE_WORKERS)
+BIG_LANE = asyncio.Semaphore(BIG_LANE_WORKERS)
+# Aged big jobs may hold at most one fast lane slot, the others stay free
+# for small jobs
+FAST_LANE_BORROW = asyncio.Semaphore(1)
+EXTRACTION_SEMAPHORE = asyncio.Semaphore(EXTRACTION_CONCURRENCY)
+
+# gallery-dl --dump-json message types
+MESSAGE_URL = 3
+MESSAGE_QUEUE = 6
+
+
+def extract_media(url, quality=DEFAULT_QUALITY):
+    """Run a gallery-dl extraction pass without downloading
+
+    Returns a list of {"url", "metadata", "queue"} entries, or None on failure,
+    and whether gallery-dl exited cleanly. Entries of a failed run may miss
+    items of the post.
+    """
+    extract_cmd = [
+        "gallery-dl",
+        "--config",
+        "./accounts/config.json",
+        "--dump-json",
+        *quality_options(quality),
+        url,
+    ]
+    try:
+        result = subprocess.run(
+            extract_cmd, capture_output=True, text=True, timeout=EXTRACTION_TIMEOUT
+        )
+        messages = json.loads(result.stdout or "[]")
+    except (subprocess.TimeoutExpired, json.JSONDecodeError) as e:
+        logger.warning(f"gallery-dl extraction failed: {e}")
+        return None, False
+
+    entries = []
+    for message in messages:
+        if (
+            isinstance(message, list)
+            and len(message) >= 3
+            and message[0] in (MESSAGE_URL, MESSAGE_QUEUE)
+        ):
+            entries.append(
+                {
+                    "url": message[1],
+                    "metadata": message[2] if isinstance(message[2], dict) else {},
+                    "queue": message[0] == MESSAGE_QUEUE,
+                }
+            )
+    complete = result.returncode == 0
+    if not entries and not complete:
+        logger.warning(f"gallery-dl extraction failed: {result.stderr}")
+        return None, False
+    return entries, complete
+
+
+# Extraction results cached per canonical post URL, so repeated or retried
+# requests skip the authenticated API calls and only hit the CDN.
+# Optionally persisted to SQLite so the cache survives restarts.
+EXTRACT_CACHE_TTL = int(os.getenv("EXTRACT_CACHE_TTL", "600"))
+EXTRACT_CACHE_SIZE = int(os.getenv("EXTRACT_CACHE_SIZE", "256"))
+EXTRACT_CACHE_DB = os.getenv("EXTRACT_CACHE_DB")
+
+EXTRACT_CACHE = OrderedDict()
+extract_cache_lock = threading.Lock()
+extract_cache_db = None
+
+# Hosts serving the same posts under different names
+HOST_ALIASES = {"x.com": "twitter.com", "mobile.twitter.com": "twitter.com"}
+
+
+def canonical_post_url(url):
+    """Normalize a post URL for use as a cache key"""
+    parsed = urlparse(url)
+    host = parsed.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    host = HOST_ALIASES.get(host, host)
+    path = parsed.path.rstrip("/") or "/"
+    return urlunparse((parsed.scheme.lower(), host, path, "", parsed.query, ""))
+
+
+def get_extract_cache_db():
+    """Open the extraction cache database, if configured"""
+    global extract_cache_db
+    if EXTRACT_CACHE_DB and extract_cache_db is None:
+        db = sqlite3.connect(EXTRACT_CACHE_DB, check_same_thread=False)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS extract_cache "
+            "(key TEXT PRIMARY KEY, expires REAL, entries TEXT)"
+        )
+        db.commit()
+        extract_cache_db = db
+    return extract_cache_db
+
+
+# Database errors and bad rows only cost a cache miss, never the job
+EXTRACT_CACHE_ERRORS = (sqlite3.Error, TypeError, ValueError)
+
+
+def extract_cache_get(key):
+    """Get cached entries for a key, or None if missing or expired"""
+    now = time.time()
+    with extract_cache_lock:
+        cached = EXTRACT_CACHE.get(key)
+        if cached and cached[0] > now:
+            EXTRACT_CACHE.move_to_end(key)
+            return cached[1]
+        EXTRACT_CACHE.pop(key, None)
+
+        try:
+            db = get_extract_cache_db()
+            if db is None:
+                return None
+            row = db.execute(
+                "SELECT expires, entries FROM extract_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if not row or row[0] <= now:
+                return None
+            entries = json.loads(row[1])
+        except EXTRACT_CACHE_ERRORS as e:
+            logger.warning(f"Extraction cache read failed for {key}: {e}")
+            return None
+        EXTRACT_CACHE[key] = (row[0], entries)
+        return entries
+
+
+def extract_cache_put(key, entries):
+    """Store entries in the cache, evicting the least recently used"""
+    expires = time.time() + EXTRACT_CACHE_TTL
+    with extract_cache_lock:
+        EXTRACT_CACHE[key] = (expires, entries)
+        EXTRACT_CACHE.move_to_end(key)
+        while len(EXTRACT_CACHE) > EXTRACT_CACHE_SIZE:
+            EXTRACT_CACHE.popitem(last=False)
+
+        try:
+            db = get_extract_cache_db()
+            if db is not None:
+                db.execute(
+                    "INSERT OR REPLACE INTO extract_cache VALUES (?, ?, ?)",
+                    (key, expires, json.dumps(entries)),
+                )
+                db.execute(
+                    "DELETE FROM extract_cache WHERE expires <= ?", (time.time(),)
+                )
+                db.commit()
+        except EXTRACT_CACHE_ERRORS as e:
+            logger.warning(f"Extraction cache write failed for {key}: {e}")
+
+
+def extract_cache_invalidate(key):
+    """Drop a cache entry, e.g. when its media URLs stopped working"""
+    with extract_cache_lock:
+        EXTRACT_CACHE.pop(key, None)
+        try:
+            db = get_extract_cache_db()
+            if db is not None:
+                db.execute("DELETE FROM extract_cache WHERE key = ?", (key,))
+                db.commit()
+        except EXTRACT_CACHE_ERRORS as e:
+            logger.warning(f"Extraction cache invalidation failed for {key}: {e}")
+
+
+def extract_cache_key(url, quality):
+    """Cache key of a post, extraction options depend on the quality profile"""
+    return f"{quality}:{canonical_post_url(url)}"
+
+
+def cached_extract_media(url, quality=DEFAULT_QUALITY):
+    """Extract media of a post, reusing a cached result when fresh"""
+    key = extract_cache_key(url, quality)
+    entries = extract_cache_get(key)
+    if entries is not None:
+        logger.info(f"Extraction cache hit for {url}")
+        return entries, True
+
+    entries, complete = extract_media(url, quality)
+    # Only cache a full extraction, a failed run may have missed items
+    if entries and complete:
+        extract_cache_put(key, entries)
+    return entries, complete
+
+
+def estimate_item_bytes(entry, quality=DEFAULT_QUALITY):
+    """Estimate the download size of one extracted item"""
+    metadata = entry["metadata"]
+    for key in ("filesize", "size", "file_size"):
+        if isinstance(metadata.get(key), int) and metadata[key] > 0:
+            return metadata[key]
+
+    # Queued URLs are resolved by another extractor, assume a video
+    extension = str(metadata.get("extension") or "").lower()
+    is_video = entry["queue"] or f".{extension}" in VIDEO_EXTENSIONS
+    if not is_video:
+        return PHOTO_BYTES_ESTIMATE
+
+    factor = QUALITY_SIZE_FACTORS.get(quality, 1.0)
+    duration = metadata.get("duration") or metadata.get("video_duration")
+    if isinstance(duration, (int, float)) and duration > 0:
+        return int(duration * VIDEO_BYTES_PER_SECOND * factor)
+    return int(VIDEO_BYTES_ESTIMATE * factor)
+
+
+def estimate_job_bytes(entries, quality=DEFAULT_QUALITY):
+    """Estimate the download size of a job from its extraction pass entries"""
+    if not entries:
+        # Unknown jobs go to the big lane
+        return None
+    return sum(estimate_item_bytes(entry, quality) for entry in entries)
+
+
+async def acquire_first(*semaphores):
+    """Acquire whichever semaphore frees up first and return it"""
+    tasks = {asyncio.create_task(sem.acquire()): sem for sem in semaphores}
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+    # A cancelled acquire may still have succeeded, keep only one slot
+    acquired = [tasks[task] for task in tasks if not task.cancelled()]
+    for sem in acquired[1:]:
+        sem.release()
+    return acquired[0]
+
+
+class BorrowedFastSlot:
+    """A fast lane slot taken by an aged big job, one at a time"""
+
+    async def acquire(self):
+        await FAST_LANE_BORROW.acquire()
+        try:
+            await FAST_LANE.acquire()
+        except BaseException:
+            FAST_LANE_BORROW.release()
+            raise
+        return True
+
+    def release(self):
+        FAST_LANE.release()
+        FAST_LANE_BORROW.release()
+
+
+@asynccontextmanager
+async def job_lane(estimated_bytes):
+    """Run a job on the fast lane if it is small, else on the big lane with aging"""
+    if estimated_bytes is not None and estimated_bytes <= SMALL_JOB_BYTES:
+        async with FAST_LANE:
+            yield "fast"
+        return
+
+    try:
+        await asyncio.wait_for(BIG_LANE.acquire(), timeout=JOB_AGING_SECONDS)
+        lane = BIG_LANE
+    except asyncio.TimeoutError:
+        # Waited long enough, take whichever lane frees up first
+        lane = await acquire_first(BIG_LANE, BorrowedFastSlot())
+
+    try:
+        yield "big" if lane is BIG_LANE else "fast"
+    finally:
+        lane.release()
+
+
+# Native downloads of direct media URLs, bypassing gallery-dl's single
+# connection: items of a post are fetched concurrently, and large files
+# with parallel HTTP Range requests
+NATIVE_DOWNLOADS = os.getenv("NATIVE_DOWNLOADS", "true").lower() == "true"
+# Extractors whose media URLs can be fetched without cookies or extra headers
+NATIVE_DOWNLOAD_CATEGORIES = [
+    category.strip()
+    for category in os.getenv(
+        "NATIVE_DOWNLOAD_CATEGORIES", "twitter,instagram,directlink"
+    ).split(",")
+    if category.strip()
+]
+RANGE_CONNECTIONS = int(os.getenv("RANGE_CONNECTIONS", "4"))
+# Items of one post downloaded at the same time
+ITEM_CONCURRENCY = int(os.getenv("ITEM_CONCURRENCY", "4"))
+RANGE_MIN_BYTES = int(os.getenv("RANGE_MIN_BYTES", str(8 * 1024 * 1024)))
+RANGE_RETRIES = 3
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+HTTP_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:128.0) Gecko/20100101 Firefox/128.0"
+)
+
+# Native downloads only run inside a lane, each lane worker fetches up to
+# ITEM_CONCURRENCY items with RANGE_CONNECTIONS connections each
+HTTP_MAX_CONNECTIONS = (
+    (FAST_LANE_WORKERS + BIG_LANE_WORKERS)
+    * ITEM_CONCURRENCY
+    * max(1, RANGE_CONNECTIONS)
+)
+
+# Shared client, its pool keeps connections alive across requests and jobs
+HTTP_CLIENT = httpx.Client(
+    headers={"User-Agent": HTTP_USER_AGENT},
+    follow_redirects=True,
+    timeout=httpx.Timeout(30, read=60),
+    limits=httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_CONNECTIONS // 2,
+    ),
+)
+
+
+def is_direct_entry(entry):
+    """Check if an extracted entry is a media URL we can download natively"""
+    metadata = entry["metadata"]
+    return (
+        not entry["queue"]
+        and entry["url"].startswith(("http://", "https://"))
+        and metadata.get("category") in NATIVE_DOWNLOAD_CATEGORIES
+        and bool(metadata.get("filename"))
+        and bool(metadata.get("extension"))
+    )
+
+
+def entry_file_path(entry, tmpdir):
+    """Get the download path of an entry, named like FILENAME_FORMAT"""
+    metadata = entry["metadata"]
+    file_name = f"{metadata['filename']}.{metadata['extension']}"
+    return os.path.join(tmpdir, file_name.replace("/", "_"))
+
+
+def write_response(response, file_path):
+    """Write a streamed response body to a file, checking its length"""
+    expected = response.headers.get("Content-Length", "")
+    written = 0
+    with open(file_path, "wb") as f:
+        for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+            f.write(chunk)
+            written += len(chunk)
+    if expected.isdigit() and written != int(expected):
+        raise IOError(f"got {written} of {expected} bytes")
+
+
+def probe_ranges(url, file_path):
+    """Get the size of a file if the server supports Range requests
+
+    A server ignoring the Range header sends the whole file, which is
+    written to file_path instead of being fetched again; None is returned.
+    """
+    with HTTP_CLIENT.stream("GET", url, headers={"Range": "bytes=0-0"}) as response:
+        response.raise_for_status()
+        if response.status_code == 206:
+            # Content-Range: bytes 0-0/TOTAL, the total may be unknown
+            total = response.headers.get("Content-Range", "").rpartition("/")[2]
+            return int(total) if total.isdigit() else 0
+        write_response(response, file_path)
+        return None
+
+
+def fetch_range(url, file_path, start, end):
+    """Download bytes start-end into a preallocated file, resuming on errors"""
+    offset = start
+    for attempt in range(RANGE_RETRIES):
+        try:
+            headers = {"Range": f"bytes={offset}-{end}"}
+            with HTTP_CLIENT.stream("GET", url, headers=headers) as response:
+                if response.status_code != 206:
+                    raise ValueError(f"expected 206, got {response.status_code}")
+                with open(file_path, "r+b") as f:
+                    f.seek(offset)
+                    for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        offset += len(chunk)
+            if offset > end:
+                return
+        except httpx.HTTPError as e:
+            logger.warning(f"Range {offset}-{end} of {url} failed: {e}")
+        time.sleep(retry_delay("transient", attempt))
+    raise IOError(f"range {start}-{end} incomplete after {RANGE_RETRIES} attempts")
+
+
+def stream_file(url, file_path):
+    """Download a file over a single connection"""
+    with HTTP_CLIENT.stream("GET", url) as response:
+        response.raise_for_status()
+        write_response(response, file_path)
+
+
+def download_file(url, file_path, size_hint=None):
+    """Download a URL, with parallel Range requests when the file is large enough
+
+    Files whose declared or estimated size is below RANGE_MIN_BYTES skip the
+    Range probe, so small carousel items cost a single request.
+    """
+    try:
+        if RANGE_CONNECTIONS <= 1 or (
+            size_hint is not None and size_hint < RANGE_MIN_BYTES
+        ):
+            stream_file(url, file_path)
+            return True
+
+        total = probe_ranges(url, file_path)
+        if total is None:
+            # No Range support, the probe already downloaded the file
+            return True
+        if total >= RANGE_MIN_BYTES:
+            # Preallocate, so every range can write at its own offset
+            with open(file_path, "wb") as f:
+                if hasattr(os, "posix_fallocate"):
+                    os.posix_fallocate(f.fileno(), 0, total)
+                else:
+                    f.truncate(total)
+
+            part_size = math.ceil(total / RANGE_CONNECTIONS)
+            ranges = [
+                (start, min(start + part_size, total) - 1)
+                for start in range(0, total, part_size)
+            ]
+            with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+                list(pool.map(lambda r: fetch_range(url, file_path, *r), ranges))
+        else:
+            stream_file(url, file_path)
+        return True
+    except Exception as e:
+        logger.warning(f"Native download of {url} failed: {e}")
+        delete_file(file_path)
+        return False
+
+
+def download_native(entries, tmpdir, url):
+    """Download direct media URLs without gallery-dl
+
+    Items of carousels and threads are fetched concurrently over the shared
+    connection pool, and returned in their original order. Returns None if
+    gallery-dl should handle the job; files that did finish are then skipped
+    by gallery-dl, since their names match FILENAME_FORMAT.
+    """
+    if not entries or not all(is_direct_entry(entry) for entry in entries):
+        return None
+
+    file_paths = [entry_file_path(entry, tmpdir) for entry in entries]
+    workers = max(1, min(ITEM_CONCURRENCY, len(entries)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(
+            pool.map(
+                lambda args: download_file(*args),
+                [
+                    (entry["url"], path, estimate_item_bytes(entry, "original"))
+                    for entry, path in zip(entries, file_paths)
+                ],
+            )
+        )
+    if not all(results):
+        return None
+
+    return [
+        build_media_item(file_path, entry["metadata"], url)
+        for entry, file_path in zip(entries, file_paths)
+    ]
+
+
+# gallery-dl writes each item's metadata as one JSON line to stdout once the
+# file is downloaded (or skipped on a retry), next to the file paths it prints
+METADATA_STREAM = [
+    {
+        "name": "metadata",
+        "event": ["after", "skip"],
+        "filename": "-",
+        "mode": "jsonl",
+    }
+]
+# Deterministic file names, so a metadata line can be matched to its file
+FILENAME_FORMAT = "{filename}.{extension}"
+
+
+def gallery_dl_command(url, tmpdir, quality=DEFAULT_QUALITY, extra_args=()):
+    """Build a gallery-dl command that downloads into tmpdir and streams metadata"""
+    return [
         "gallery-dl",
-        "--write-info-json",
         "--config",
         "./accounts/config.json",
         "--directory",
         tmpdir,
+        "-o",
+        f"filename={FILENAME_FORMAT}",
+        "-o",
+        f"postprocessors={json.dumps(METADATA_STREAM)}",
+        *quality_options(quality),
+        *extra_args,
         url,
     ]
 
+
+def media_type(file_path):
+    """Get the Telegram media type for a file"""
+    lower_path = file_path.lower()
+    if lower_path.endswith(VIDEO_EXTENSIONS):
+        return "video"
+    if lower_path.endswith((".jpg", ".jpeg", ".png", ".gif", ".webp")):
+        return "photo"
+    return "document"
+
+
+def build_media_item(file_path, metadata, url):
+    """Build a per-item record from gallery-dl metadata"""
+    author_data = metadata.get("author") or {}
+    if not isinstance(author_data, dict):
+        author_data = {}
+
+    post_url = metadata.get("post_url")
+    tweet_id = metadata.get("tweet_id")
+    if not post_url and metadata.get("category") == "twitter" and tweet_id:
+        post_url = f"https://x.com/{author_data.get('name') or 'i'}/status/{tweet_id}"
+
+    return {
+        "path": file_path,
+        "type": media_type(file_path),
+        "width": metadata.get("width"),
+        "height": metadata.get("height"),
+        # Items of the same post share this id, e.g. in a profile timeline
+        "post_id": str(
+            metadata.get("post_id")
+            or metadata.get("tweet_id")
+            or metadata.get("post_shortcode")
+            or post_url
+            or url
+        ),
+        "post_url": post_url or url,
+        "description": (
+            metadata.get("description")
+            or metadata.get("content")
+            or metadata.get("desc")
+            or ""
+        ),
+        "username": metadata.get("username") or author_data.get("name") or "",
+        "fullname": metadata.get("fullname") or author_data.get("nick") or "",
+    }
+
+
+def parse_gallery_dl_output(stdout, tmpdir, url):
+    """Build media items from gallery-dl's stdout, in download order
+
+    stdout has one line per file path (prefixed with "# " when skipped)
+    and one JSON line per item from the metadata post processor. Files
+    without a metadata line are placed where their path was printed.
+    """
+    items = []
+    used_paths = set()
+    # Printed paths no metadata line was matched to, with their position
+    unmatched_paths = []
+    last_path = None
+    for line in stdout.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        if not line.startswith("{"):
+            if last_path:
+                unmatched_paths.append((len(items), last_path))
+            last_path = line[2:] if line.startswith("# ") else line
+            continue
+
+        try:
+            metadata = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if not isinstance(metadata, dict):
+            continue
+
+        # Match the file by its deterministic name, else use the last printed path
+        file_name = f"{metadata.get('filename')}.{metadata.get('extension')}"
+        file_path = os.path.join(tmpdir, file_name.replace("/", "_"))
+        if not os.path.exists(file_path):
+            file_path = last_path
+        if last_path and last_path != file_path:
+            unmatched_paths.append((len(items), last_path))
+        if file_path and os.path.exists(file_path) and file_path not in used_paths:
+            items.append(build_media_item(file_path, metadata, url))
+            used_paths.add(file_path)
+        last_path = None
+    if last_path:
+        unmatched_paths.append((len(items), last_path))
+
+    return add_leftover_files(items, unmatched_paths, tmpdir, url)
+
+
+def add_leftover_files(items, unmatched_paths, tmpdir, url):
+    """Add files without a metadata line (e.g. merged by yt-dlp) to the items
+
+    A file goes where gallery-dl printed its path, matched by name without
+    the extension since merging may change it, and inherits the metadata of
+    the item before it. Files with no printed path go last.
+    """
+    described = {os.path.abspath(item["path"]) for item in items}
+    leftover_files = []
+    for root, dirs, files in os.walk(tmpdir):
+        for file in files:
+            file_path = os.path.join(root, file)
+            # Skip JSON files and other non-media files
+            if file.endswith((".json", ".tmp", ".part")):
+                continue
+            if os.path.abspath(file_path) not in described:
+                leftover_files.append(file_path)
+    if not leftover_files:
+        return items
+    logger.warning(f"No metadata for {len(leftover_files)} file(s)")
+
+    # (position, print order, path), sorted leftovers without a position go last
+    placed = []
+    for file_path in sorted(leftover_files):
+        stem = os.path.splitext(os.path.abspath(file_path))[0]
+        position, order = len(items), len(unmatched_paths)
+        for index, (printed_position, printed_path) in enumerate(unmatched_paths):
+            if os.path.splitext(os.path.abspath(printed_path))[0] == stem:
+                position, order = printed_position, index
+                break
+        placed.append((position, order, file_path))
+    placed.sort(key=lambda leftover: leftover[:2])
+
+    result = []
+    leftovers = iter(placed)
+    leftover = next(leftovers, None)
+    for position in range(len(items) + 1):
+        while leftover and leftover[0] == position:
+            if result:
+                neighbor = result[-1]
+            elif items:
+                neighbor = items[0]
+            else:
+                neighbor = build_media_item("", {}, url)
+            result.append(
+                dict(
+                    neighbor,
+                    path=leftover[2],
+                    type=media_type(leftover[2]),
+                    width=None,
+                    height=None,
+                )
+            )
+            leftover = next(leftovers, None)
+        if position < len(items):
+            result.append(items[position])
+    return result
+
+
+def download_media(url, quality=DEFAULT_QUALITY, tmpdir=TMP_DIR, entries=None):
+    """Download media using gallery-dl, or natively for direct media URLs"""
+    # Download into the job folder
+    # dont use tempfile, use `./tmp` folder instead
+    os.makedirs(tmpdir, exist_ok=True)
+
+    # Size of the job at original quality, to measure what the profile saved
+    original_bytes = estimate_job_bytes(entries, "original")
+
+    # Entries from the extraction pass can skip gallery-dl's download
+    if NATIVE_DOWNLOADS:
+        items = download_native(entries, tmpdir, url)
+        if items:
+            record_quality_stats(
+                quality, [item["path"] for item in items], original_bytes
+            )
+            first = items[0]
+            return (
+                items,
+                first["post_url"],
+                first["description"],
+                first["username"],
+                first["fullname"],
+            )
+        if entries:
+            # Cached media URLs may have expired, extract again next time
+            extract_cache_invalidate(extract_cache_key(url, quality))
+
+    # Run gallery-dl to download media, metadata is streamed over stdout
+    download_cmd = gallery_dl_command(url, tmpdir, quality)
+
     try:
-        result = subprocess.run(download_cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            logger.error(f"gallery-dl download failed: {result.stderr}")
+        result, error_kind = run_gallery_dl(download_cmd)
+        if error_kind:
             return None, None, None, None, None
 
-        # Look for info.json file for metadata
-        info_file_path = None
-        downloaded_files = []
-
-        # Walk through the directory only once to find both info.json and media files
-        for root, dirs, files in os.walk(tmpdir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if file == "info.json":
-                    info_file_path = file_path
-                # Skip JSON files and other non-media files
-                elif not file.endswith((".json", ".tmp", ".part")):
-                    downloaded_files.append(file_path)
-
-        # Sort files to ensure consistent ordering
-        downloaded_files.sort()
-
-        # Parse metadata from info.json to get post URL for caption
-        post_url = url  # Default to original URL
-        description = ""
-        username = ""
-        fullname = ""
-        if info_file_path and os.path.exists(info_file_path):
-            try:
-                with open(info_file_path, "r") as f:
-                    metadata = json.load(f)
-                post_url = metadata.get("post_url") or url
-                description = (
-                    metadata.get("description")
-                    or metadata.get("content")
-                    or metadata.get("desc")
-                    or ""
-                )
-                author_data = metadata.get("author", {})
-                username = metadata.get("username") or author_data.get("name") or ""
-                fullname = metadata.get("fullname") or author_data.get("nick") or ""
+        # Files without a metadata line keep their download position
+        items = parse_gallery_dl_output(result.stdout, tmpdir, url)
+        post_metadata = items[0] if items else build_media_item("", {}, url)
 
-            except (json.JSONDecodeError, IOError) as e:
-                logger.error(f"Error reading info.json: {e}")
-        else:
-            logger.warning("info.json file not found")
+        record_quality_stats(quality, [item["path"] for item in items], original_bytes)
+
+        # Post-level caption fields come from the first item
+        post_url = post_metadata["post_url"]
+        description = post_metadata["description"]
+        username = post_metadata["username"]
+        fullname = post_metadata["fullname"]
 
-        return downloaded_files, post_url, description, username, fullname
+        return items, post_url, description, username, fullname
 
     except Exception as e:
         logger.error(f"Error downloading media: {e}")
@@ -207,17 +1219,411 @@ def delete_file(file_path):
         logger.error(f"Error deleting file {file_path}: {e}")
 
 
+# Local media preparation with ffprobe/ffmpeg, so Telegram gets video
+# attributes and a thumbnail upfront instead of probing the file itself
+FFMPEG = shutil.which("ffmpeg")
+FFPROBE = shutil.which("ffprobe")
+MEDIA_PREP_WORKERS = int(os.getenv("MEDIA_PREP_WORKERS", "2"))
+# PNG/WebP stills larger than this are recompressed to JPEG
+STILL_RECOMPRESS_BYTES = int(os.getenv("STILL_RECOMPRESS_BYTES", str(5 * 1024 * 1024)))
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".webm")
+STREAMABLE_CODECS = ("h264", "hevc")
+
+media_prep_pool = None
+
+
+def get_media_prep_pool():
+    """Get the process pool used for media preparation"""
+    global media_prep_pool
+    if media_prep_pool is None:
+        media_prep_pool = ProcessPoolExecutor(max_workers=MEDIA_PREP_WORKERS)
+    return media_prep_pool
+
+
+def run_ffmpeg(args):
+    """Run ffmpeg quietly, return True on success"""
+    result = subprocess.run(
+        [FFMPEG, "-y", "-v", "error", *args], capture_output=True, text=True, timeout=600
+    )
+    if result.returncode != 0:
+        logger.warning(f"ffmpeg failed: {result.stderr.strip()}")
+        return False
+    return True
+
+
+def probe_video(file_path):
+    """Get width, height, duration and codec of a video with ffprobe"""
+    result = subprocess.run(
+        [
+            FFPROBE,
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "stream=width,height,codec_name:format=duration",
+            "-of",
+            "json",
+            file_path,
+        ],
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    if result.returncode != 0:
+        logger.warning(f"ffprobe failed for {file_path}: {result.stderr.strip()}")
+        return {}
+
+    data = json.loads(result.stdout or "{}")
+    streams = data.get("streams") or [{}]
+    duration = data.get("format", {}).get("duration")
+    return {
+        "width": streams[0].get("width"),
+        "height": streams[0].get("height"),
+        "codec": streams[0].get("codec_name"),
+        "duration": round(float(duration)) if duration else None,
+    }
+
+
+def is_faststart(file_path):
+    """Check if an MP4's moov atom comes before its mdat atom"""
+    with open(file_path, "rb") as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return False
+            size = int.from_bytes(header[:4], "big")
+            atom = header[4:]
+            if atom == b"moov":
+                return True
+            if atom == b"mdat":
+                return False
+            if size == 1:
+                # 64-bit size follows the header
+                size = int.from_bytes(f.read(8), "big") - 8
+            elif size == 0:
+                # Atom runs to the end of the file
+                return False
+            if size < 8:
+                return False
+            f.seek(size - 8, os.SEEK_CUR)
+
+
+def prepare_video(file_path):
+    """Probe a video, remux it to faststart MP4 and generate a thumbnail"""
+    info = {"path": file_path}
+    info.update(probe_video(file_path))
+
+    # Remux to MP4 with the moov atom up front so clients can stream it,
+    # most MP4s from Twitter/Instagram already are and are left alone
+    base, ext = os.path.splitext(file_path)
+    is_mp4 = ext.lower() in (".mp4", ".mov")
+    if is_mp4 and is_faststart(file_path):
+        info["supports_streaming"] = True
+    elif is_mp4 or info.get("codec") in STREAMABLE_CODECS:
+        remuxed_path = f"{base}.faststart.mp4"
+        if run_ffmpeg(
+            ["-i", file_path, "-map", "0", "-c", "copy", "-movflags", "+faststart", remuxed_path]
+        ):
+            os.remove(file_path)
+            info["path"] = f"{base}.mp4"
+            os.replace(remuxed_path, info["path"])
+            info["supports_streaming"] = True
+        elif os.path.exists(remuxed_path):
+            os.remove(remuxed_path)
+
+    # Thumbnail: JPEG, at most 320px on each side
+    thumbnail_path = f"{base}.thumb.jpg"
+    seek = min(1, (info.get("duration") or 0) / 2)
+    if run_ffmpeg(
+        [
+            "-ss",
+            str(seek),
+            "-i",
+            info["path"],
+            "-frames:v",
+            "1",
+            "-vf",
+            "scale=320:320:force_original_aspect_ratio=decrease",
+            "-q:v",
+            "5",
+            thumbnail_path,
+        ]
+    ):
+        info["thumbnail"] = thumbnail_path
+
+    return info
+
+
+def prepare_still(file_path):
+    """Recompress oversized PNG/WebP stills to JPEG"""
+    info = {"path": file_path}
+    if os.path.getsize(file_path) <= STILL_RECOMPRESS_BYTES:
+        return info
+
+    base, _ = os.path.splitext(file_path)
+    jpeg_path = f"{base}.jpg"
+    if run_ffmpeg(["-i", file_path, "-q:v", "3", jpeg_path]):
+        # Keep whichever is smaller
+        if os.path.getsize(jpeg_path) < os.path.getsize(file_path):
+            os.remove(file_path)
+            info["path"] = jpeg_path
+        else:
+            os.remove(jpeg_path)
+    return info
+
+
+def prepare_media(file_path):
+    """Prepare a downloaded file for upload, runs in the media prep process pool"""
+    try:
+        lower_path = file_path.lower()
+        if lower_path.endswith(VIDEO_EXTENSIONS):
+            return prepare_video(file_path)
+        if lower_path.endswith((".png", ".webp")):
+            return prepare_still(file_path)
+    except Exception as e:
+        logger.error(f"Error preparing media {file_path}: {e}")
+    return {"path": file_path}
+
+
+async def prepare_media_files(items):
+    """Prepare all items concurrently in the process pool, keeping their order
+
+    Probed values take precedence over the dimensions from the item metadata.
+    """
+    if not FFMPEG or not FFPROBE:
+        return [dict(item) for item in items]
+
+    loop = asyncio.get_running_loop()
+    pool = get_media_prep_pool()
+    prepared = await asyncio.gather(
+        *(loop.run_in_executor(pool, prepare_media, item["path"]) for item in items)
+    )
+
+    media_info = []
+    for item, info in zip(items, prepared):
+        merged = dict(item)
+        merged.update({key: value for key, value in info.items() if value is not None})
+        media_info.append(merged)
+    return media_info
+
+
+def video_attributes(info):
+    """Build send_video/InputMediaVideo keyword arguments from prepared media info"""
+    attributes = {"supports_streaming": info.get("supports_streaming", False)}
+    for key in ("width", "height", "duration"):
+        if info.get(key):
+            attributes[key] = info[key]
+
+    thumbnail_path = info.get("thumbnail")
+    if thumbnail_path and os.path.exists(thumbnail_path):
+        attributes["thumbnail"] = read_media(thumbnail_path)
+    return attributes
+
+
+def read_media(file_path):
+    """Get a file for a media group: its path on a local Bot API server, its bytes otherwise"""
+    if BOT_API_LOCAL_MODE:
+        return Path(os.path.abspath(file_path))
+    with open(file_path, "rb") as f:
+        return f.read()
+
+
+@contextmanager
+def open_media(file_path):
+    """Open a file for upload, a local Bot API server reads it from disk by path instead"""
+    if BOT_API_LOCAL_MODE:
+        yield Path(os.path.abspath(file_path))
+        return
+    with open(file_path, "rb") as f:
+        yield f
+
+
+# Outbound rate limits: Telegram allows about 30 messages per second overall,
+# 1 per second in a private chat and 20 per minute in a group
+GLOBAL_SEND_RATE = float(os.getenv("GLOBAL_SEND_RATE", "30"))
+PRIVATE_CHAT_SEND_RATE = float(os.getenv("PRIVATE_CHAT_SEND_RATE", "1"))
+GROUP_CHAT_SEND_RATE = float(os.getenv("GROUP_CHAT_SEND_RATE", str(20 / 60)))
+SEND_RETRIES = int(os.getenv("SEND_RETRIES", "5"))
+
+
+class TokenBucket:
+    """Token bucket rate limiter, can be paused for flood waits"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def pause(self, seconds):
+        """Hold all sends for a flood wait"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        # Start refilling from empty once the wait is over
+        self.tokens = 0
+        self.updated = self.paused_until
+
+    async def acquire(self, cost=1):
+        """Wait until `cost` tokens are available and take them"""
+        # A media group may cost more than the bucket holds
+        cost = min(cost, self.capacity)
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.refill()
+            if self.tokens >= cost:
+                self.tokens -= cost
+                return
+            await asyncio.sleep((cost - self.tokens) / self.rate)
+
+
+GLOBAL_SEND_BUCKET = TokenBucket(GLOBAL_SEND_RATE, GLOBAL_SEND_RATE)
+CHAT_SEND_BUCKETS = {}
+# Sends to one chat go out one after another, in order
+CHAT_SEND_LOCKS = defaultdict(asyncio.Lock)
+
+
+def get_chat_bucket(chat_id, chat_type):
+    """Get the token bucket of a chat"""
+    if chat_id not in CHAT_SEND_BUCKETS:
+        if chat_type in ["group", "supergroup", "channel"]:
+            CHAT_SEND_BUCKETS[chat_id] = TokenBucket(GROUP_CHAT_SEND_RATE, 20)
+        else:
+            # Burst of 10 so a full media group can go out at once
+            CHAT_SEND_BUCKETS[chat_id] = TokenBucket(PRIVATE_CHAT_SEND_RATE, 10)
+    return CHAT_SEND_BUCKETS[chat_id]
+
+
+def request_not_sent(error):
+    """Whether a NetworkError happened before the request reached Telegram"""
+    return isinstance(
+        error.__cause__, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+    )
+
+
+async def send_scheduled(chat_id, chat_type, send, cost=1):
+    """Run a Telegram send within the global and per-chat rate budgets
+
+    `send` is called again on retries, so it must build its request from
+    scratch. RetryAfter pauses the chat and reschedules the send, network
+    errors from before the request went out are retried with backoff. Any
+    other NetworkError, including BadRequest and TimedOut, is raised right
+    away: after a timeout Telegram may already have accepted the upload.
+    """
+    chat_bucket = get_chat_bucket(chat_id, chat_type)
+    async with CHAT_SEND_LOCKS[chat_id]:
+        for attempt in range(SEND_RETRIES + 1):
+            await chat_bucket.acquire(cost)
+            await GLOBAL_SEND_BUCKET.acquire(cost)
+            try:
+                return await send()
+            except RetryAfter as e:
+                if attempt == SEND_RETRIES:
+                    raise
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(f"Flood wait in chat {chat_id}, retrying in {retry_after}s")
+                chat_bucket.pause(retry_after)
+            except NetworkError as e:
+                if attempt == SEND_RETRIES or not request_not_sent(e):
+                    raise
+                delay = retry_delay("transient", attempt)
+                logger.warning(
+                    f"Network error sending to chat {chat_id}: {e}, retrying in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+
+
+async def send_single_file(bot, chat_id, info, caption):
+    """Send one file as video, photo or document"""
+    file_path = info["path"]
+    if file_path.lower().endswith((".mp4", ".avi", ".mov", ".mkv", ".webm")):
+        with open_media(file_path) as video:
+            return await bot.send_video(
+                chat_id=chat_id,
+                video=video,
+                caption=caption,
+                **video_attributes(info),
+            )
+    elif file_path.lower().endswith((".jpg", ".jpeg", ".png", ".gif", ".webp")):
+        with open_media(file_path) as photo:
+            return await bot.send_photo(chat_id=chat_id, photo=photo, caption=caption)
+    else:
+        with open_media(file_path) as document:
+            return await bot.send_document(
+                chat_id=chat_id, document=document, caption=caption
+            )
+
+
 async def send_media(
-    update: Update,
-    context: ContextTypes.DEFAULT_TYPE,
-    file_paths,
+    bot,
+    chat_id,
+    chat_type,
+    items,
     post_url,
     description,
     fullname,
     username,
 ):
-    """Send media files to user"""
-    chat_id = update.effective_chat.id
+    """Send media files to a chat, returns the ids of the sent messages"""
+    # Probe, remux and thumbnail videos, recompress oversized stills
+    media_info = await prepare_media_files(items)
+    return await send_prepared_media(
+        bot, chat_id, chat_type, media_info, post_url, description, fullname, username
+    )
+
+
+async def send_prepared_media(
+    bot,
+    chat_id,
+    chat_type,
+    media_info,
+    post_url,
+    description,
+    fullname,
+    username,
+    keep_files=False,
+):
+    """Send prepared media files to a chat, returns the ids of the sent messages
+
+    Forbidden is raised, the bot can't post to the chat at all. With
+    keep_files the files stay in place, so they can be sent to another chat.
+    """
+    message_ids = []
+
+    # Skip files over the Bot API upload limit
+    too_large = [
+        info
+        for info in media_info
+        if os.path.exists(info["path"]) and os.path.getsize(info["path"]) > UPLOAD_LIMIT
+    ]
+    for info in too_large:
+        logger.warning(f"File exceeds upload limit: {info['path']}")
+        if not keep_files:
+            delete_file(info["path"])
+            if info.get("thumbnail"):
+                delete_file(info["thumbnail"])
+    if too_large:
+        await send_scheduled(
+            chat_id,
+            chat_type,
+            lambda: bot.send_message(
+                chat_id=chat_id,
+                text=f"Skipped {len(too_large)} file(s) larger than {format_bytes(UPLOAD_LIMIT)}.",
+            ),
+        )
+    media_info = [info for info in media_info if info not in too_large]
+    file_paths = [info["path"] for info in media_info]
 
     file_caption = f"{description}\n\nBy: {fullname} ({username})\n{post_url}"
 
@@ -232,26 +1638,30 @@ async def send_media(
 
             # Create all media items for this group
             for j, file_path in enumerate(media_group):
-                # Create caption only for the first file of each group
+                # Create caption only for the first file of each group, other
+                # items only get their own description when it differs
                 caption = file_caption if j == 0 else None
+                item_description = media_info[i + j].get("description")
+                if j > 0 and item_description and item_description != description:
+                    caption = item_description
 
                 try:
                     if file_path.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
-                        # Open file, create media item, then immediately close
-                        with open(file_path, "rb") as f:
-                            media_item = InputMediaPhoto(
-                                media=f.read(), caption=caption
-                            )
+                        # Read file (or pass its path in local mode) for the media item
+                        media_item = InputMediaPhoto(
+                            media=read_media(file_path), caption=caption
+                        )
                         media_group_items.append(media_item)
                         group_files.append(file_path)
                     elif file_path.lower().endswith(
                         (".mp4", ".avi", ".mov", ".mkv", ".webm")
                     ):
-                        # Open file, create media item, then immediately close
-                        with open(file_path, "rb") as f:
-                            media_item = InputMediaVideo(
-                                media=f.read(), caption=caption
-                            )
+                        # Read file (or pass its path in local mode) for the media item
+                        media_item = InputMediaVideo(
+                            media=read_media(file_path),
+                            caption=caption,
+                            **video_attributes(media_info[i + j]),
+                        )
                         media_group_items.append(media_item)
                         group_files.append(file_path)
                     else:
@@ -259,64 +1669,82 @@ async def send_media(
                         logger.warning(
                             f"Unsupported media type for media group: {file_path}"
                         )
-                        delete_file(file_path)
+                        if not keep_files:
+                            delete_file(file_path)
                 except Exception as e:
                     logger.error(f"Error opening file {file_path}: {e}")
                     # Try to delete the problematic file
-                    delete_file(file_path)
+                    if not keep_files:
+                        delete_file(file_path)
 
             # Send this group of media items
             if media_group_items:
                 try:
-                    await context.bot.send_media_group(
-                        chat_id=chat_id, media=media_group_items
+                    messages = await send_scheduled(
+                        chat_id,
+                        chat_type,
+                        lambda: bot.send_media_group(
+                            chat_id=chat_id, media=media_group_items
+                        ),
+                        cost=len(media_group_items),
                     )
+                    message_ids += [message.message_id for message in messages]
                     # Delete files after successful send
-                    for file_path in group_files:
-                        delete_file(file_path)
+                    if not keep_files:
+                        for file_path in group_files:
+                            delete_file(file_path)
+                except Forbidden:
+                    raise
                 except Exception as e:
                     logger.error(f"Unexpected error sending media group: {e}")
                     # Send error message for the first group
                     if i == 0:
-                        await context.bot.send_message(
-                            chat_id=chat_id, text=f"Error sending media group: {str(e)}"
+                        # Don't close over `e`, it is deleted when the except block ends
+                        error_text = str(e)
+                        await send_scheduled(
+                            chat_id,
+                            chat_type,
+                            lambda: bot.send_message(
+                                chat_id=chat_id,
+                                text=f"Error sending media group: {error_text}",
+                            ),
                         )
-                    # Delete files even if sending failed
-                    for file_path in group_files:
-                        delete_file(file_path)
+                    # Delete files even if sending failed after all retries
+                    if not keep_files:
+                        for file_path in group_files:
+                            delete_file(file_path)
     else:
         # Single file - send normally
         for i, file_path in enumerate(file_paths):
             try:
                 caption = file_caption if i == 0 else None
 
-                if file_path.lower().endswith(
-                    (".mp4", ".avi", ".mov", ".mkv", ".webm")
-                ):
-                    with open(file_path, "rb") as video:
-                        await context.bot.send_video(
-                            chat_id=chat_id, video=video, caption=caption
-                        )
-                elif file_path.lower().endswith(
-                    (".jpg", ".jpeg", ".png", ".gif", ".webp")
-                ):
-                    with open(file_path, "rb") as photo:
-                        await context.bot.send_photo(
-                            chat_id=chat_id, photo=photo, caption=caption
-                        )
-                else:
-                    with open(file_path, "rb") as document:
-                        await context.bot.send_document(
-                            chat_id=chat_id, document=document, caption=caption
-                        )
+                message = await send_scheduled(
+                    chat_id,
+                    chat_type,
+                    lambda: send_single_file(bot, chat_id, media_info[i], caption),
+                )
+                message_ids.append(message.message_id)
 
                 # Delete file after successful send
-                delete_file(file_path)
+                if not keep_files:
+                    delete_file(file_path)
 
+            except Forbidden:
+                raise
             except Exception as e:
                 logger.error(f"Error sending file {file_path}: {e}")
-                # Delete file even if sending failed
-                delete_file(file_path)
+                # Delete file even if sending failed after all retries
+                if not keep_files:
+                    delete_file(file_path)
+
+    # Delete generated thumbnails
+    if not keep_files:
+        for info in media_info:
+            if info.get("thumbnail"):
+                delete_file(info["thumbnail"])
+
+    return message_ids
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -348,12 +1776,78 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id=update.effective_chat.id, action="upload_document"
     )
 
-    # Download media
-    file_paths, post_url, description, username, fullname = download_media(
-        clean_url_str
+    # Download media with the quality profile of this chat/user
+    quality = get_quality(update.effective_chat.id, user_id)
+
+    # Quick extraction pass, used to estimate the job size so small jobs
+    # don't wait behind big ones, and to download direct media URLs natively
+    entries, complete = None, False
+    if SIZE_AWARE_SCHEDULING or NATIVE_DOWNLOADS:
+        async with EXTRACTION_SEMAPHORE:
+            entries, complete = await asyncio.to_thread(
+                cached_extract_media, clean_url_str, quality
+            )
+
+    # Without size-aware scheduling every job runs on the fast lane
+    estimated_bytes = 0
+    if SIZE_AWARE_SCHEDULING:
+        estimated_bytes = estimate_job_bytes(entries, quality)
+
+    # Wait for disk space before taking a lane slot, so a job deferred for
+    # low disk space doesn't block a lane, then reserve it within the lane
+    budget = max(JOB_DISK_BUDGET, 2 * (estimated_bytes or 0))
+    if not await disk_room_available(budget):
+        logger.warning("Not enough disk space, job rejected")
+        await update.message.reply_text(
+            "Not enough disk space right now, please try again later."
+        )
+        return
+
+    async with job_lane(estimated_bytes) as lane:
+        logger.info(
+            f"Job for {clean_url_str} on {lane} lane, estimated "
+            f"{format_bytes(estimated_bytes) if estimated_bytes is not None else 'unknown size'}"
+        )
+
+        async with disk_admission(budget) as admitted:
+            if not admitted:
+                await update.message.reply_text(
+                    "Not enough disk space right now, please try again later."
+                )
+                return
+
+            job_dir = new_job_dir()
+            try:
+                # Partial entries are fine for the size estimate, but a
+                # native download of them would send an incomplete album
+                await download_and_send(
+                    update,
+                    context,
+                    clean_url_str,
+                    quality,
+                    job_dir,
+                    entries if complete else None,
+                )
+            finally:
+                # Remove everything the job left behind, including on errors
+                remove_job_dir(job_dir)
+
+
+async def download_and_send(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    url,
+    quality,
+    job_dir,
+    entries=None,
+):
+    """Download media of a URL into the job folder and send it"""
+    # Run the blocking download in a thread so other jobs keep going
+    items, post_url, description, username, fullname = await asyncio.to_thread(
+        download_media, url, quality, job_dir, entries
     )
 
-    if file_paths is None:
+    if items is None:
         # Send error message if download failed
         # Check if message is from a group chat
         chat_type = update.effective_chat.type
@@ -365,7 +1859,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 logger.warning(f"Could not delete user's message: {e}")
         return
 
-    if not file_paths:
+    if not items:
         # Send message if no media found
         # Check if message is from a group chat
         chat_type = update.effective_chat.type
@@ -388,7 +1882,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Send media
     await send_media(
-        update, context, file_paths, post_url, description, fullname, username
+        context.bot,
+        update.effective_chat.id,
+        update.effective_chat.type,
+        items,
+        post_url,
+        description,
+        fullname,
+        username,
     )
 
 
@@ -456,10 +1957,481 @@ async def list_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
 
 
+async def quality_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Command to show or set the media quality profile of this chat"""
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+
+    # Check if user is accepted
+    if not is_user_accepted(user_id):
+        await update.message.reply_text("You are not authorized to use this bot.")
+        return
+
+    profiles = ", ".join(QUALITY_PROFILES)
+
+    if context.args:
+        profile = context.args[0].lower().replace("-", "_")
+        if profile not in QUALITY_PROFILES:
+            await update.message.reply_text(
+                f"Unknown quality profile. Available profiles: {profiles}"
+            )
+            return
+
+        set_quality_pref(chat_id, profile)
+        await update.message.reply_text(f"Quality for this chat set to {profile}.")
+        return
+
+    # Show current profile and per-profile statistics
+    lines = [
+        f"Current quality: {get_quality(chat_id, user_id)}",
+        f"Available profiles: {profiles}",
+        "Usage: /quality [profile]",
+        "",
+    ]
+    for profile, stats in QUALITY_STATS.items():
+        line = f"{profile}: {stats['jobs']} job(s), {format_bytes(stats['bytes'])}"
+        if stats["measured"]:
+            line += (
+                f", ~{format_bytes(stats['saved'])} saved vs original"
+                f" (estimated over {stats['measured']} job(s))"
+            )
+        lines.append(line)
+
+    await update.message.reply_text("\n".join(lines))
+
+
+# Watch mode: followed accounts are polled periodically and new media is
+# posted to every subscribed chat. One poll per account is shared by all
+# its chats, and gallery-dl's download archive makes it fetch only new items.
+WATCH_FILE = os.getenv("WATCH_FILE", "./accounts/watches.json")
+WATCH_ARCHIVE = os.getenv("WATCH_ARCHIVE", "./accounts/watch_archive.sqlite3")
+WATCH_INTERVAL = int(os.getenv("WATCH_INTERVAL", "900"))
+# Newest files looked at per poll, a carousel counts once per file
+WATCH_MAX_ITEMS = int(os.getenv("WATCH_MAX_ITEMS", "20"))
+WATCH_CONCURRENCY = int(os.getenv("WATCH_CONCURRENCY", "2"))
+WATCH_TICK = 30
+# Stop a poll after this many already archived files in a row. Pinned posts
+# are skipped, otherwise an old pinned carousel would stop every poll.
+WATCH_ABORT_AFTER = 3
+
+WATCH_SEMAPHORE = asyncio.Semaphore(WATCH_CONCURRENCY)
+watch_next_poll = {}
+watch_polling = set()
+watch_task = None
+# Running polls, referenced so they are not garbage collected
+watch_poll_tasks = set()
+
+
+def load_watches():
+    """Load subscriptions, keyed by canonical profile URL"""
+    try:
+        with open(WATCH_FILE, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (json.JSONDecodeError, IOError) as e:
+        logger.error(f"Error reading {WATCH_FILE}: {e}")
+        return {}
+
+
+def save_watches():
+    """Write subscriptions to disk"""
+    os.makedirs(os.path.dirname(WATCH_FILE) or ".", exist_ok=True)
+    with open(WATCH_FILE, "w") as f:
+        json.dump(WATCHES, f, indent=2)
+
+
+WATCHES = load_watches()
+
+
+def add_watch(url, chat_id, chat_type):
+    """Subscribe a chat to an account, returns False if already subscribed"""
+    account = canonical_post_url(url)
+    watch = WATCHES.setdefault(account, {"url": url, "chats": [], "primed": False})
+    if any(chat["id"] == chat_id for chat in watch["chats"]):
+        return False
+    watch["chats"].append({"id": chat_id, "type": chat_type})
+    save_watches()
+
+    # Prime new accounts right away, so only posts after now get sent
+    if not watch["primed"]:
+        watch_next_poll[account] = time.time()
+    return True
+
+
+def remove_watch(url, chat_id):
+    """Unsubscribe a chat from an account, returns False if not subscribed"""
+    account = canonical_post_url(url)
+    watch = WATCHES.get(account)
+    if not watch or not any(chat["id"] == chat_id for chat in watch["chats"]):
+        return False
+    watch["chats"] = [chat for chat in watch["chats"] if chat["id"] != chat_id]
+    if not watch["chats"]:
+        del WATCHES[account]
+        watch_next_poll.pop(account, None)
+    save_watches()
+    return True
+
+
+def watch_offset(account):
+    """Stable offset within the interval, so polls are spread across time"""
+    return zlib.crc32(account.encode()) % max(1, WATCH_INTERVAL)
+
+
+def poll_account(url, primed, tmpdir):
+    """Fetch new items of an account, returns media items or None on failure
+
+    The first poll only records the newest items in the archive.
+    """
+    extra_args = [
+        "--download-archive",
+        WATCH_ARCHIVE,
+        "--range",
+        f"1-{WATCH_MAX_ITEMS}",
+        "-o",
+        "extractor.instagram.pinned=false",
+    ]
+    if primed:
+        extra_args += ["--abort", str(WATCH_ABORT_AFTER)]
+    else:
+        extra_args += ["--no-download"]
+
+    result, error_kind = run_gallery_dl(
+        gallery_dl_command(url, tmpdir, DEFAULT_QUALITY, extra_args)
+    )
+    if error_kind:
+        return None
+    return parse_gallery_dl_output(result.stdout, tmpdir, url)
+
+
+def group_items_by_post(items):
+    """Split items into posts, keeping their order"""
+    posts = []
+    for item in items:
+        if posts and posts[-1][0]["post_id"] == item["post_id"]:
+            posts[-1].append(item)
+        else:
+            posts.append([item])
+    return posts
+
+
+async def deliver_watch_post(bot, watch, post_items):
+    """Upload a post to one subscribed chat, then copy it to the others
+
+    Each chat is tried as the upload source in turn, so a chat the bot can
+    no longer post to doesn't cost the other chats the post. Its items are
+    already in the archive and would never be fetched again.
+    """
+    first = post_items[0]
+    media_info = await prepare_media_files(post_items)
+
+    message_ids = []
+    source = None
+    for chat in list(watch["chats"]):
+        try:
+            message_ids = await send_prepared_media(
+                bot,
+                chat["id"],
+                chat["type"],
+                media_info,
+                first["post_url"],
+                first["description"],
+                first["fullname"],
+                first["username"],
+                keep_files=True,
+            )
+        except Forbidden as e:
+            logger.warning(f"Unsubscribing chat {chat['id']} from {watch['url']}: {e}")
+            remove_watch(watch["url"], chat["id"])
+            continue
+        except Exception as e:
+            logger.error(f"Error sending watched post to chat {chat['id']}: {e}")
+            continue
+        if message_ids:
+            source = chat
+            break
+        logger.warning(
+            f"Could not send watched post {first['post_url']} to chat {chat['id']}"
+        )
+
+    if source is None:
+        logger.error(f"No subscribed chat took watched post {first['post_url']}")
+        return
+
+    # Copying by message id reuses the uploaded files, nothing is uploaded twice
+    for chat in list(watch["chats"]):
+        if chat["id"] == source["id"]:
+            continue
+        try:
+            await send_scheduled(
+                chat["id"],
+                chat["type"],
+                lambda: bot.copy_messages(
+                    chat_id=chat["id"],
+                    from_chat_id=source["id"],
+                    message_ids=message_ids,
+                ),
+                cost=len(message_ids),
+            )
+        except Forbidden as e:
+            logger.warning(f"Unsubscribing chat {chat['id']} from {watch['url']}: {e}")
+            remove_watch(watch["url"], chat["id"])
+        except Exception as e:
+            logger.error(f"Error copying watched post to chat {chat['id']}: {e}")
+
+
+async def poll_watch(bot, account):
+    """Poll one account and post its new media to the subscribed chats"""
+    try:
+        async with WATCH_SEMAPHORE, disk_admission() as admitted:
+            watch = WATCHES.get(account)
+            if not admitted or not watch:
+                return
+
+            job_dir = new_job_dir()
+            try:
+                items = await asyncio.to_thread(
+                    poll_account, watch["url"], watch["primed"], job_dir
+                )
+                if items is None:
+                    return
+                if not watch["primed"]:
+                    watch["primed"] = True
+                    save_watches()
+                    return
+
+                # Timelines list the newest post first, send oldest first
+                for post_items in reversed(group_items_by_post(items)):
+                    await deliver_watch_post(bot, watch, post_items)
+            finally:
+                remove_job_dir(job_dir)
+    except Exception as e:
+        logger.error(f"Error polling {account}: {e}")
+    finally:
+        watch_polling.discard(account)
+
+
+async def watch_loop(bot):
+    """Start polls of accounts when they are due"""
+    while True:
+        now = time.time()
+        for account in list(WATCHES):
+            if account not in watch_next_poll:
+                watch_next_poll[account] = now + watch_offset(account)
+            if now < watch_next_poll[account] or account in watch_polling:
+                continue
+
+            # Keep each account on its own slot within the interval
+            watch_next_poll[account] += WATCH_INTERVAL
+            if watch_next_poll[account] <= now:
+                watch_next_poll[account] = now + WATCH_INTERVAL
+            watch_polling.add(account)
+            task = asyncio.create_task(poll_watch(bot, account))
+            watch_poll_tasks.add(task)
+            task.add_done_callback(watch_poll_tasks.discard)
+
+        await asyncio.sleep(WATCH_TICK)
+
+
+async def watch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Command to post new media of an account to this chat"""
+    # Check if user is accepted
+    if not is_user_accepted(update.effective_user.id):
+        await update.message.reply_text("You are not authorized to use this bot.")
+        return
+
+    urls = extract_urls(" ".join(context.args or []))
+    if not urls:
+        await update.message.reply_text("Usage: /watch <profile-url>")
+        return
+
+    url = clean_url(urls[0])
+    if add_watch(url, update.effective_chat.id, update.effective_chat.type):
+        await update.message.reply_text(
+            f"Watching {url}, new posts will be sent to this chat."
+        )
+    else:
+        await update.message.reply_text(f"This chat is already watching {url}.")
+
+
+async def unwatch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Command to stop watching an account in this chat"""
+    # Check if user is accepted
+    if not is_user_accepted(update.effective_user.id):
+        await update.message.reply_text("You are not authorized to use this bot.")
+        return
+
+    urls = extract_urls(" ".join(context.args or []))
+    if not urls:
+        await update.message.reply_text("Usage: /unwatch <profile-url>")
+        return
+
+    url = clean_url(urls[0])
+    if remove_watch(url, update.effective_chat.id):
+        await update.message.reply_text(f"Stopped watching {url}.")
+    else:
+        await update.message.reply_text(f"This chat is not watching {url}.")
+
+
+async def watches_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Command to list the accounts watched in this chat"""
+    # Check if user is accepted
+    if not is_user_accepted(update.effective_user.id):
+        await update.message.reply_text("You are not authorized to use this bot.")
+        return
+
+    chat_id = update.effective_chat.id
+    urls = [
+        watch["url"]
+        for watch in WATCHES.values()
+        if any(chat["id"] == chat_id for chat in watch["chats"])
+    ]
+    if urls:
+        await update.message.reply_text("Watched accounts:\n" + "\n".join(urls))
+    else:
+        await update.message.reply_text("This chat is not watching any accounts.")
+
+
+# Live profiling state for the admin commands
+PROFILE_MAX_SECONDS = 300
+profiling_active = False
+last_memory_snapshot = None
+
+
+async def send_report(update: Update, filename, report):
+    """Send a text report as a document"""
+    await update.message.reply_document(
+        document=io.BytesIO(report.encode()), filename=filename
+    )
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Command to profile the event loop for a number of seconds"""
+    global profiling_active
+
+    # Check if user is admin
+    if str(update.effective_user.id) != ADMIN_USER_ID:
+        await update.message.reply_text("You are not authorized to profile the bot.")
+        return
+
+    try:
+        seconds = int(context.args[0]) if context.args else 30
+    except ValueError:
+        await update.message.reply_text("Usage: /profile [seconds]")
+        return
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+
+    if profiling_active:
+        await update.message.reply_text("A profiling session is already running.")
+        return
+
+    await update.message.reply_text(f"Profiling for {seconds}s...")
+
+    # Profiles everything running on the event loop thread, such as
+    # handle_message and send_media; downloads run in threads/subprocesses
+    profiling_active = True
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+        profiling_active = False
+
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output)
+    stats.sort_stats("cumulative").print_stats(60)
+    output.write("\n")
+    stats.sort_stats("tottime").print_stats(30)
+    await send_report(update, "profile.txt", output.getvalue())
+
+
+async def memory_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Command to take tracemalloc snapshots and diff them against the previous one"""
+    global last_memory_snapshot
+
+    # Check if user is admin
+    if str(update.effective_user.id) != ADMIN_USER_ID:
+        await update.message.reply_text("You are not authorized to profile the bot.")
+        return
+
+    if context.args and context.args[0] == "stop":
+        tracemalloc.stop()
+        last_memory_snapshot = None
+        await update.message.reply_text("Memory tracing stopped.")
+        return
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(10)
+        last_memory_snapshot = tracemalloc.take_snapshot()
+        await update.message.reply_text(
+            "Memory tracing started. Run /memory again to diff, /memory stop to stop."
+        )
+        return
+
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [
+        f"Traced memory: {format_bytes(current)} (peak {format_bytes(peak)})",
+        "",
+        "Top differences since the previous snapshot:",
+    ]
+    lines += [str(stat) for stat in snapshot.compare_to(last_memory_snapshot, "lineno")[:30]]
+    lines += ["", "Top allocations:"]
+    lines += [str(stat) for stat in snapshot.statistics("lineno")[:30]]
+    last_memory_snapshot = snapshot
+
+    await send_report(update, "memory.txt", "\n".join(lines))
+
+
+async def tasks_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Command to dump the stacks of all asyncio tasks"""
+    # Check if user is admin
+    if str(update.effective_user.id) != ADMIN_USER_ID:
+        await update.message.reply_text("You are not authorized to profile the bot.")
+        return
+
+    tasks = asyncio.all_tasks()
+    output = io.StringIO()
+    output.write(f"{len(tasks)} task(s)\n\n")
+    for task in tasks:
+        output.write(f"{task!r}\n")
+        task.print_stack(file=output)
+        output.write("\n")
+
+    await send_report(update, "tasks.txt", output.getvalue())
+
+
+async def post_init(application: Application):
+    """Start background tasks once the bot is initialized"""
+    global janitor_task, watch_task
+    janitor_task = asyncio.create_task(janitor_loop())
+    watch_task = asyncio.create_task(watch_loop(application.bot))
+
+
 def main():
     """Start the bot"""
+    # Nothing is running yet, so every job folder left in tmp is orphaned
+    sweep_tmp(0)
+
     # Create the Application and pass it your bot's token
-    application = Application.builder().token(TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(MAX_CONCURRENT_JOBS)
+        .media_write_timeout(UPLOAD_TIMEOUT)
+        .post_init(post_init)
+    )
+
+    # Use a self-hosted Bot API server if configured
+    if BOT_API_URL:
+        builder = builder.base_url(BOT_API_URL)
+        if BOT_API_FILE_URL:
+            builder = builder.base_file_url(BOT_API_FILE_URL)
+        builder = builder.local_mode(BOT_API_LOCAL_MODE)
+        logger.info(f"Using Bot API server {BOT_API_URL} (local mode: {BOT_API_LOCAL_MODE})")
+
+    application = builder.build()
 
     # Register message handler
     application.add_handler(
@@ -469,6 +2441,13 @@ def main():
     # Register command handlers
     application.add_handler(CommandHandler("adduser", add_user_command))
     application.add_handler(CommandHandler("listusers", list_users_command))
+    application.add_handler(CommandHandler("quality", quality_command))
+    application.add_handler(CommandHandler("watch", watch_command))
+    application.add_handler(CommandHandler("unwatch", unwatch_command))
+    application.add_handler(CommandHandler("watches", watches_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("memory", memory_command))
+    application.add_handler(CommandHandler("tasks", tasks_command))
 
     # Start the Bot
     application.run_polling(allowed_updates=Update.ALL_TYPES)
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote_to_bytes
+
+# bot.py reads its configuration on import
+os.environ.setdefault("telegram_token", "123456:TEST")
+os.environ["BOT_API_URL"] = "http://127.0.0.1:0/bot"
+os.environ["BOT_API_LOCAL_MODE"] = "true"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+from telegram import Bot  # noqa: E402
+
+MESSAGE = {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}}
+
+
+class StubBotAPI(BaseHTTPRequestHandler):
+    """Stand-in Bot API server that records every request"""
+
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        method = self.path.rsplit("/", 1)[-1]
+        if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+            body = unquote_to_bytes(body.replace(b"+", b" "))
+        StubBotAPI.requests.append((method, self.headers.get("Content-Type"), body))
+
+        result = [MESSAGE] if method == "sendMediaGroup" else MESSAGE
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub"}
+        payload = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class LocalBotAPITest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubBotAPI)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}/bot"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        StubBotAPI.requests.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def make_items(self, *names):
+        items = []
+        for name in names:
+            path = os.path.join(self.tmpdir.name, name)
+            with open(path, "wb") as f:
+                f.write(b"MEDIA-BYTES")
+            items.append({"path": path, "description": ""})
+        return items
+
+    def send(self, local_mode, items):
+        bot.BOT_API_LOCAL_MODE = local_mode
+        self.addCleanup(setattr, bot, "BOT_API_LOCAL_MODE", True)
+        # Keep the files, they are deleted after sending
+        paths = [os.path.abspath(item["path"]) for item in items]
+
+        async def run():
+            async with Bot(
+                "123456:TEST", base_url=self.base_url, local_mode=local_mode
+            ) as telegram_bot:
+                await bot.send_media(
+                    telegram_bot, 1, "private", items, "https://x", "", "", ""
+                )
+
+        asyncio.run(run())
+        return paths
+
+    def test_upload_limit_is_2000_mb_in_local_mode(self):
+        self.assertEqual(bot.UPLOAD_LIMIT, 2000 * 1024 * 1024)
+
+    def test_local_mode_sends_file_uris(self):
+        paths = self.send(True, self.make_items("a.mp4"))
+        method, content_type, body = StubBotAPI.requests[-1]
+        self.assertEqual(method, "sendVideo")
+        self.assertNotIn(b"MEDIA-BYTES", body)
+        self.assertIn(f"file://{paths[0]}".encode(), body)
+
+    def test_local_mode_media_group_sends_file_uris(self):
+        paths = self.send(True, self.make_items("a.jpg", "b.mp4"))
+        method, content_type, body = StubBotAPI.requests[-1]
+        self.assertEqual(method, "sendMediaGroup")
+        self.assertNotIn(b"MEDIA-BYTES", body)
+        for path in paths:
+            self.assertIn(f"file://{path}".encode(), body)
+
+    def test_local_mode_thumbnail_is_sent_by_path(self):
+        items = self.make_items("a.mp4")
+        thumbnail = os.path.abspath(os.path.join(self.tmpdir.name, "a.thumb.jpg"))
+        with open(thumbnail, "wb") as f:
+            f.write(b"THUMB-BYTES")
+        items[0]["thumbnail"] = thumbnail
+        self.send(True, items)
+        method, content_type, body = StubBotAPI.requests[-1]
+        self.assertNotIn(b"THUMB-BYTES", body)
+        self.assertIn(f"file://{thumbnail}".encode(), body)
+
+    def test_remote_mode_uploads_bytes(self):
+        paths = self.send(False, self.make_items("a.mp4"))
+        method, content_type, body = StubBotAPI.requests[-1]
+        self.assertEqual(method, "sendVideo")
+        self.assertTrue(content_type.startswith("multipart/form-data"))
+        self.assertIn(b"MEDIA-BYTES", body)
+        self.assertNotIn(f"file://{paths[0]}".encode(), body)
+
+    def test_remote_mode_media_group_uploads_bytes(self):
+        self.send(False, self.make_items("a.jpg", "b.mp4"))
+        method, content_type, body = StubBotAPI.requests[-1]
+        self.assertEqual(method, "sendMediaGroup")
+        self.assertEqual(body.count(b"MEDIA-BYTES"), 2)
+        self.assertNotIn(b"file://", body)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# bot.py reads its configuration on import
+os.environ.setdefault("telegram_token", "123456:TEST")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+# Served per connection at about 6.4 MB/s, like a throttled CDN
+CHUNK_SIZE = 64 * 1024
+CHUNK_DELAY = 0.01
+FILES = {
+    "photo.jpg": os.urandom(200 * 1024),
+    "video.mp4": os.urandom(2 * 1024 * 1024),
+}
+
+
+class StubCDN(BaseHTTPRequestHandler):
+    """File server that records requests, /ranged/ paths honor Range headers"""
+
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        StubCDN.requests.append((self.path, self.headers.get("Range")))
+        body = FILES[self.path.rsplit("/", 1)[-1]]
+        range_header = self.headers.get("Range")
+        if self.path.startswith("/ranged/") and range_header:
+            start, _, end = range_header.removeprefix("bytes=").partition("-")
+            start, end = int(start), min(int(end or len(body) - 1), len(body) - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+            body = body[start : end + 1]
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        for offset in range(0, len(body), CHUNK_SIZE):
+            self.wfile.write(body[offset : offset + CHUNK_SIZE])
+            time.sleep(CHUNK_DELAY)
+
+
+class NativeDownloadTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubCDN)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        StubCDN.requests.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        for name, value in (("RANGE_MIN_BYTES", 1024 * 1024), ("RANGE_CONNECTIONS", 4)):
+            self.addCleanup(setattr, bot, name, getattr(bot, name))
+            setattr(bot, name, value)
+
+    def download(self, path, size_hint=None):
+        file_path = os.path.join(self.tmpdir.name, path.rsplit("/", 1)[-1])
+        self.assertTrue(bot.download_file(self.base_url + path, file_path, size_hint))
+        with open(file_path, "rb") as f:
+            self.assertEqual(f.read(), FILES[os.path.basename(file_path)])
+
+    def test_small_file_skips_range_probe(self):
+        self.download("/ranged/photo.jpg", size_hint=len(FILES["photo.jpg"]))
+        self.assertEqual(StubCDN.requests, [("/ranged/photo.jpg", None)])
+
+    def test_probe_body_is_reused_without_range_support(self):
+        self.download("/plain/video.mp4")
+        self.assertEqual(StubCDN.requests, [("/plain/video.mp4", "bytes=0-0")])
+
+    def test_large_file_uses_parallel_ranges(self):
+        self.download("/ranged/video.mp4")
+        self.assertEqual(StubCDN.requests[0], ("/ranged/video.mp4", "bytes=0-0"))
+        self.assertEqual(len(StubCDN.requests), 1 + bot.RANGE_CONNECTIONS)
+
+    def test_carousel_items_keep_their_order(self):
+        entries = [
+            {
+                "url": f"{self.base_url}/ranged/{name}",
+                "queue": False,
+                "metadata": {
+                    "category": "instagram",
+                    "filename": name.partition(".")[0],
+                    "extension": name.partition(".")[2],
+                },
+            }
+            for name in ("video.mp4", "photo.jpg")
+        ]
+        items = bot.download_native(entries, self.tmpdir.name, "https://x/p/1")
+        self.assertEqual(
+            [os.path.basename(item["path"]) for item in items],
+            ["video.mp4", "photo.jpg"],
+        )
+
+    def test_benchmark_parallel_ranges(self):
+        start = time.perf_counter()
+        self.download("/ranged/video.mp4", size_hint=0)
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self.download("/ranged/video.mp4")
+        parallel = time.perf_counter() - start
+
+        print(f"\n2 MB file: {single:.2f}s single, {parallel:.2f}s with 4 ranges")
+        self.assertLess(parallel, single * 0.6)
+
+
+if __name__ == "__main__":
+    unittest.main()